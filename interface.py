@@ -1,26 +1,21 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
+import os
 import pickle
-import json
+import tempfile
+import orjson
+import sys
 from datetime import time, date
+from pathlib import Path
 from preditor_ofc import AccidentPredictor  # Importa a classe correta
 
-# Carregar o modelo treinado e seus componentes
-@st.cache_resource
+# Carregar o modelo treinado e seus componentes (uma única instância por processo, sem expiração)
+@st.cache_resource(ttl=None, max_entries=1, show_spinner=False, validate=None)
 def load_model():
     try:
-        with open("modelo_acidentes.pkl", "rb") as f:
-            data = pickle.load(f)
-        
-        predictor = AccidentPredictor()
-        predictor.modelo = data["modelo"]
-        predictor.encoders = data["encoders"]
-        predictor.feature_names = data["features"]
-        predictor.best_params = data["params"]
-        predictor.r2_score = data["r2"]
-        predictor.rmse_score = data["rmse"]
-        predictor.treinado = True
+        predictor = AccidentPredictor.carregar_modelo()
+        if predictor.acelerador is None:
+            st.warning("Não foi possível usar o modelo compilado nem o ONNX; usando o modelo LightGBM original.")
         return predictor
 
     except FileNotFoundError:
@@ -30,64 +25,114 @@ def load_model():
         st.error(f"Erro ao carregar o modelo: {e}")
         return None
 
-# Carregar as opções de UF, Município e Condição Climática
-@st.cache_data
+# Opções usadas se os arquivos JSON de opções não estiverem disponíveis
+UF_OPTIONS_PADRAO = ["MG", "SP", "RJ", "ES", "PR", "SC", "RS"]
+MUNICIPIOS_POR_UF_PADRAO = {
+    "MG": ["BELO HORIZONTE", "UBERLÂNDIA", "CONTAGEM"],
+    "SP": ["SÃO PAULO", "CAMPINAS", "GUARULHOS"],
+    "RJ": ["RIO DE JANEIRO", "NITERÓI", "DUQUE DE CAXIAS"],
+    "ES": ["VITÓRIA", "VILA VELHA", "SERRA"],
+    "PR": ["CURITIBA", "LONDRINA", "MARINGÁ"],
+    "SC": ["FLORIANÓPOLIS", "JOINVILLE", "BLUMENAU"],
+    "RS": ["PORTO ALEGRE", "CAXIAS DO SUL", "CANOAS"]
+}
+CONDICOES_METEREOLOGICAS_PADRAO = ["Bom", "Chuva", "Nublado", "Vento", "Nevoeiro/Neblina", "Outro"]
+
+# Lê um arquivo JSON de opções, reaproveitando uma cópia em pickle ao lado dele quando ela
+# é mais nova que o JSON (o cache_resource só vale dentro do processo; isso vale entre reinícios)
+def _cached_json(path):
+    path = Path(path)
+    cache = path.with_suffix(".pkl")
+    try:
+        if cache.stat().st_mtime >= path.stat().st_mtime:
+            with open(cache, "rb") as f:
+                return pickle.load(f)
+    except Exception:
+        pass # Cache ausente, antigo ou corrompido: relê o JSON
+
+    dados = orjson.loads(path.read_bytes())
+
+    # Grava num arquivo temporário do mesmo diretório e troca de uma vez com os.replace, para
+    # que uma gravação interrompida nunca deixe um cache truncado no lugar
+    tmp = None
+    try:
+        with tempfile.NamedTemporaryFile("wb", dir=cache.parent, prefix=cache.name, suffix=".tmp", delete=False) as f:
+            tmp = f.name
+            pickle.dump(dados, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache)
+    except OSError:
+        # Sem permissão de escrita ou disco cheio: apenas não há cache em disco
+        if tmp is not None:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    return dados
+
+# Carregar as opções de UF, Município e Condição Climática. As opções não são alteradas depois
+# de carregadas, então cache_resource evita a cópia via pickle que o cache_data faz a cada rerun
+@st.cache_resource(ttl=None, max_entries=1, show_spinner=False)
 def load_options():
-    # Estas opções não são salvas no modelo, então vamos usar um conjunto padrão ou inferir do datatran_consolidado.json
-    # Para simplificar, vamos usar algumas opções comuns. Em um cenário real, estas seriam geradas a partir dos dados de treinamento.
-    uf_options = ["MG", "SP", "RJ", "ES", "PR", "SC", "RS"]
+    # As opções vêm dos arquivos JSON gerados a partir do datatran_consolidado.json; arquivo
+    # ausente ou malformado cai nas listas padrão
+    try:
+        uf_options = _cached_json("uf_options.json")
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        uf_options = UF_OPTIONS_PADRAO
+
+    try:
+        municipios_por_uf = _cached_json("municipios_por_uf.json")
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        municipios_por_uf = MUNICIPIOS_POR_UF_PADRAO
+
+    try:
+        condicoes_metereologicas_options = _cached_json("condicoes_metereologicas_options.json")
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        condicoes_metereologicas_options = CONDICOES_METEREOLOGICAS_PADRAO
+
+    # Tuplas imutáveis para os selectbox e strings internadas, para que os lookups nos mapas
+    # dos encoders comparem por ponteiro
+    uf_options = tuple(sys.intern(uf) for uf in uf_options)
     municipios_por_uf = {
-        "MG": ["BELO HORIZONTE", "UBERLÂNDIA", "CONTAGEM"],
-        "SP": ["SÃO PAULO", "CAMPINAS", "GUARULHOS"],
-        "RJ": ["RIO DE JANEIRO", "NITERÓI", "DUQUE DE CAXIAS"],
-        "ES": ["VITÓRIA", "VILA VELHA", "SERRA"],
-        "PR": ["CURITIBA", "LONDRINA", "MARINGÁ"],
-        "SC": ["FLORIANÓPOLIS", "JOINVILLE", "BLUMENAU"],
-        "RS": ["PORTO ALEGRE", "CAXIAS DO SUL", "CANOAS"]
+        sys.intern(uf): tuple(sys.intern(m) for m in municipios)
+        for uf, municipios in municipios_por_uf.items()
     }
-    condicoes_metereologicas_options = ["Bom", "Chuva", "Nublado", "Vento", "Nevoeiro/Neblina", "Outro"]
-    
+    condicoes_metereologicas_options = tuple(sys.intern(c) for c in condicoes_metereologicas_options)
+
     return uf_options, municipios_por_uf, condicoes_metereologicas_options
 
-predictor = load_model()
-uf_options, municipios_por_uf, condicoes_metereologicas_options = load_options()
+# Cada rerun reexecuta o script; guardar o resultado na sessão evita passar pelo lookup (e hash
+# da chave) do cache do Streamlit a cada interação. Os caches continuam garantindo uma única
+# instância por processo, compartilhada entre as sessões
+opcoes_removidas = None
+if "predictor" not in st.session_state:
+    st.session_state["predictor"] = load_model()
+    st.session_state["options"] = load_options()
+    if st.session_state["predictor"]:
+        st.session_state["options"], opcoes_removidas = st.session_state["predictor"].filtrar_opcoes(*st.session_state["options"])
+
+predictor = st.session_state["predictor"]
+uf_options, municipios_por_uf, condicoes_metereologicas_options = st.session_state["options"]
 
 st.title("Preditor de Acidentes de Trânsito 🚗")
 
+# Avisa uma única vez por sessão, na primeira execução
+if opcoes_removidas and any(opcoes_removidas.values()):
+    resumo = ", ".join(f"{n} {tipo}" for tipo, n in opcoes_removidas.items() if n)
+    st.warning(f"Opções não vistas no treinamento do modelo foram removidas da seleção: {resumo}.")
+
 if predictor:
     uf = st.selectbox("UF", uf_options)
-    municipios_filtrados = municipios_por_uf.get(uf, ["DESCONHECIDO"])
+    municipios_filtrados = municipios_por_uf.get(uf, ())
     municipio = st.selectbox("Município", municipios_filtrados)
     horario = st.time_input("Horário", time(0, 0))
     condicao_metereologica = st.selectbox("Condição Climática", condicoes_metereologicas_options)
 
     if st.button("Prever Acidentes"):
         try:
-            # Garantir formato do horário
-            horario_str = horario.strftime("%H:%M:%S") if hasattr(horario, "strftime") else str(horario)
-            
             # Data para previsão (pode ser a data atual ou uma data futura)
             data_previsao = date.today() # Usar a data atual para a previsão
-            data_ddmmyyyy = data_previsao.strftime("%d/%m/%Y")
-
-            # Criar um DataFrame com os novos dados para previsão
-            novos_dados_df = pd.DataFrame([
-                {
-                    "data_inversa": data_ddmmyyyy,
-                    "horario": horario_str,
-                    "uf": uf,
-                    "municipio": municipio,
-                    "tipo_acidente": "COLISÃO", # Valor padrão, pois não é uma entrada do usuário
-                    "condicao_metereologica": condicao_metereologica
-                }
-            ])
-
-            # Faz a previsão usando o método 'prever' da classe AccidentPredictor
-            previsoes_df = predictor.prever(novos_dados_df)
-            
-            # A classe AccidentPredictor.prever retorna um DataFrame com 'data' e 'previsoes_acidentes'
-            # Pegamos o primeiro (e único) valor de previsão
-            predicao = int(previsoes_df["previsoes_acidentes"].iloc[0])
+            predicao = predictor.prever_hora(data_previsao, horario.hour, uf, municipio, condicao_metereologica)
 
             st.success(f"A previsão de acidentes para as condições informadas é: **{predicao}**")
 
@@ -95,6 +140,14 @@ if predictor:
             st.error("Ocorreu um erro ao fazer a predição.")
             st.exception(e_all)
 
+    if st.checkbox("Comparar todas as horas do dia"):
+        try:
+            previsoes_horas = predictor.previsoes_horas(date.today(), uf, municipio, condicao_metereologica)
+            st.line_chart(pd.DataFrame({"Acidentes previstos": previsoes_horas}, index=pd.RangeIndex(24, name="Hora")))
+        except Exception as e_all:
+            st.error("Ocorreu um erro ao prever as horas do dia.")
+            st.exception(e_all)
+
 else:
     st.warning("O modelo ainda não foi treinado.")
 
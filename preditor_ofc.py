@@ -1,9 +1,15 @@
 import pandas as pd
 import numpy as np
 import json
+import math
+import ctypes
+import functools
+import sys
 import pickle
+import mmap
 import lightgbm as lgb
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from pathlib import Path
 from sklearn.preprocessing import LabelEncoder
 from sklearn.model_selection import TimeSeriesSplit
 from sklearn.metrics import r2_score, mean_squared_error
@@ -11,9 +17,66 @@ import holidays
 import warnings
 import itertools
 
+# Aceleradores opcionais de inferência: sem eles o predictor usa o modelo LightGBM diretamente
+try:
+    import onnxruntime as ort
+    from onnxmltools import convert_lightgbm
+    from onnxmltools.convert.common.data_types import FloatTensorType
+except ImportError:
+    ort = None
+
+try:
+    import treelite
+    import tl2cgen
+except ImportError:
+    treelite = tl2cgen = None
+
 warnings.filterwarnings("ignore")
 
 
+TIPO_ACIDENTE_PADRAO = "COLISÃO" # Valor padrão para previsões, pois não é uma entrada do usuário
+
+
+# Features cíclicas do calendário em uma única chamada, com math.sin/cos sobre escalares
+# (cada np.sin em um float Python custa um dispatch de ufunc)
+def _calendar_feats(dia_semana, dia_ano):
+    fim_semana = int(dia_semana >= 5)
+    ang_semana = 2 * math.pi * dia_semana / 7
+    ang_ano = 2 * math.pi * dia_ano / 365.25
+    return fim_semana, math.sin(ang_semana), math.cos(ang_semana), math.sin(ang_ano), math.cos(ang_ano)
+
+
+# Expressão que preenche cada feature em _fill, em função dos argumentos de _fill
+_EXPRESSOES_FEATURES = {
+    "ano": "ano", "mes": "mes", "dia_semana": "dia_semana", "dia_ano": "dia_ano",
+    "semana": "semana", "fim_semana": "fim_semana",
+    "dia_semana_sin": "dia_semana_sin", "dia_semana_cos": "dia_semana_cos",
+    "dia_ano_sin": "dia_ano_sin", "dia_ano_cos": "dia_ano_cos",
+    "hora_media": "hora", "feriado": "feriado", "feriado_fim_semana": "feriado * fim_semana",
+    "uf_enc": "enc_uf", "municipio_enc": "enc_municipio",
+    "tipo_acidente_enc": "enc_tipo", "clima_enc": "enc_clima",
+}
+
+
+# Gera, para a ordem de features deste modelo, uma função com uma atribuição por posição do
+# buffer (sem dict nem busca por nome no clique). Features fora de _EXPRESSOES_FEATURES (lags,
+# médias e desvios, sempre 0 numa previsão isolada) nunca são escritas e ficam com o 0 inicial
+def _gerar_fill(feature_names):
+    linhas = [
+        f"    row[{i}] = {_EXPRESSOES_FEATURES[nome]}"
+        for i, nome in enumerate(feature_names) if nome in _EXPRESSOES_FEATURES
+    ]
+    src = (
+        "def _fill(row, ano, mes, dia_semana, dia_ano, semana, fim_semana,\n"
+        "          dia_semana_sin, dia_semana_cos, dia_ano_sin, dia_ano_cos,\n"
+        "          hora, feriado, enc_uf, enc_municipio, enc_tipo, enc_clima):\n"
+        + "\n".join(linhas or ["    pass"]) + "\n"
+    )
+    globs = {}
+    exec(src, globs)
+    return globs["_fill"]
+
+
 class AccidentPredictor:
     def __init__(self):
         self.modelo = lgb.LGBMRegressor(random_state=42)
@@ -24,6 +87,10 @@ class AccidentPredictor:
         self.r2_score = None
         self.rmse_score = None
         self.holidays_br = holidays.Brazil()
+        self._ort_sess = None
+        self._tl = None
+        self._X_treino = None
+        self._tabela_cache = None
 
     def _simplificar_clima(self, cond):
         if any(k in cond for k in ["Chuva", "Garoa"]):
@@ -144,6 +211,169 @@ class AccidentPredictor:
 
         return best
 
+    def _prever_modelo(self, X):
+        # Usa a biblioteca compilada pelo tl2cgen ou a sessão ONNX Runtime quando disponíveis
+        # (ver carregar_modelo)
+        if self._tl is not None:
+            return self._tl.predict(tl2cgen.DMatrix(np.asarray(X, dtype=np.float64))).ravel()
+        if self._ort_sess is not None:
+            return self._ort_sess.run(None, {"X": np.asarray(X, dtype=np.float32)})[0].ravel()
+        return self.modelo.predict(X)
+
+    def _codigo_clima(self, condicao_metereologica):
+        # Código do encoder de clima para uma condição bruta, com a mesma dupla simplificação
+        # de _processar_dados
+        clima = self._simplificar_clima(self._simplificar_clima(condicao_metereologica))
+        return self._enc_maps["clima"][clima]
+
+    def _eh_feriado(self, d):
+        # O frozenset cobre o período de carregar_modelo; fora dele consulta o holidays_br,
+        # que se expande sozinho para qualquer ano, como em _criar_features
+        if d.year in self._anos_feriados:
+            return int(d in self._holidays_set)
+        return int(d in self.holidays_br)
+
+    def build_feature_vector(self, data_fixa, hora, uf, municipio, condicao_metereologica):
+        # Monta a linha de features de um modelo carregado por carregar_modelo num array ctypes de
+        # floats novo a cada chamada (o predictor pode ser compartilhado entre threads, então não há
+        # buffer comum), preenchido sem pandas nem NumPy e entregue pela view (1, n_features) sem cópia.
+        # Reproduz o que prever calcula para uma única linha: lags, médias e desvios ficam em 0.
+        # UF, município e clima precisam existir nos encoders (ver filtrar_opcoes)
+        enc_maps = self._enc_maps
+
+        dia_semana = data_fixa.weekday()
+        dia_ano = data_fixa.timetuple().tm_yday
+        fim_semana, dia_semana_sin, dia_semana_cos, dia_ano_sin, dia_ano_cos = _calendar_feats(dia_semana, dia_ano)
+        feriado = self._eh_feriado(data_fixa)
+
+        row = (ctypes.c_float * len(self.feature_names))()
+        self._fill(
+            row, data_fixa.year, data_fixa.month, dia_semana, dia_ano,
+            data_fixa.isocalendar()[1], fim_semana,
+            dia_semana_sin, dia_semana_cos, dia_ano_sin, dia_ano_cos,
+            hora, feriado,
+            enc_maps["uf"][uf],
+            enc_maps["municipio"][municipio],
+            self._enc_tipo_padrao,
+            self._codigo_clima(condicao_metereologica),
+        )
+        return np.frombuffer(row, dtype=np.float32).reshape(1, -1)
+
+    def build_feature_matrix(self, dates, hours, ufs, municipios, climas):
+        # Versão em lote de build_feature_vector, para avaliação offline e previsões em massa: cada
+        # argumento é uma sequência de tamanho N e o resultado é uma matriz (N, n_features) na ordem
+        # de feature_names. Cada coluna categórica é codificada com um único searchsorted sobre
+        # enc.classes_ (que o LabelEncoder mantém ordenado); valores desconhecidos viram -1, como em
+        # _criar_features. Depende só do que treinar/carregar_modelo definem no modelo
+        idx = {nome: i for i, nome in enumerate(self.feature_names)}
+        n = len(dates)
+        X = np.zeros((n, len(self.feature_names)), np.float32)
+
+        dt = pd.DatetimeIndex(dates)
+        dia_semana = dt.dayofweek.to_numpy()
+        dia_ano = dt.dayofyear.to_numpy()
+        fim_semana = (dia_semana >= 5).astype(int)
+        # Feriados de exatamente os anos presentes nas datas, para qualquer período
+        feriados = np.array(sorted(holidays.Brazil(years=sorted(set(dt.year)))), dtype="datetime64[D]")
+        feriado = np.isin(dt.to_numpy().astype("datetime64[D]"), feriados).astype(int)
+
+        X[:, idx["ano"]] = dt.year
+        X[:, idx["mes"]] = dt.month
+        X[:, idx["dia_semana"]] = dia_semana
+        X[:, idx["dia_ano"]] = dia_ano
+        X[:, idx["semana"]] = dt.isocalendar().week.to_numpy(dtype=int)
+        X[:, idx["fim_semana"]] = fim_semana
+        X[:, idx["dia_semana_sin"]] = np.sin(2 * np.pi * dia_semana / 7)
+        X[:, idx["dia_semana_cos"]] = np.cos(2 * np.pi * dia_semana / 7)
+        X[:, idx["dia_ano_sin"]] = np.sin(2 * np.pi * dia_ano / 365.25)
+        X[:, idx["dia_ano_cos"]] = np.cos(2 * np.pi * dia_ano / 365.25)
+        X[:, idx["hora_media"]] = hours
+        X[:, idx["feriado"]] = feriado
+        X[:, idx["feriado_fim_semana"]] = feriado * fim_semana
+
+        # A simplificação do clima é feita só sobre os valores distintos
+        climas_unicos, inverso = np.unique(np.asarray(climas, dtype=object), return_inverse=True)
+        simplificados = np.array(
+            [self._simplificar_clima(self._simplificar_clima(c)) for c in climas_unicos], dtype=object
+        )
+
+        mapping = {
+            "uf": np.asarray(ufs, dtype=object),
+            "municipio": np.asarray(municipios, dtype=object),
+            "tipo_acidente": np.full(n, TIPO_ACIDENTE_PADRAO, dtype=object),
+            "clima": simplificados[inverso],
+        }
+        for col, vals in mapping.items():
+            classes = self.encoders[col].classes_
+            pos = np.minimum(np.searchsorted(classes, vals), len(classes) - 1)
+            X[:, idx[f"{col}_enc"]] = np.where(classes[pos] == vals, pos, -1)
+
+        return X
+
+    @property
+    def acelerador(self):
+        # Runtime usado em _prever_modelo: "tl2cgen", "onnx" ou None para o LightGBM original
+        if self._tl is not None:
+            return "tl2cgen"
+        if self._ort_sess is not None:
+            return "onnx"
+        return None
+
+    def _montar_tabela(self, data_fixa, uf, municipio):
+        # Fixados data, UF e município, o modelo só varia com a hora e o clima: prevê todas as
+        # combinações em uma única chamada e devolve uma tabela (24, n_climas) indexada por
+        # [hora, código do clima]. Só há colunas para as classes do encoder, pois o clima
+        # consultado precisa existir nele (ver filtrar_opcoes)
+        idx = self._feat_index
+        n_climas = len(self.encoders["clima"].classes_)
+
+        # Hora e clima da linha base são sobrescritos logo abaixo; as classes do encoder de clima
+        # já são valores simplificados, então qualquer uma serve de clima válido para a base
+        base = self.build_feature_vector(data_fixa, 0, uf, municipio, self.encoders["clima"].classes_[0])
+        X = np.repeat(base, 24 * n_climas, axis=0)
+        X[:, idx["hora_media"]] = np.repeat(np.arange(24), n_climas)
+        X[:, idx["clima_enc"]] = np.tile(np.arange(n_climas), 24)
+
+        previsoes = np.clip(np.round(self._prever_modelo(X)), 0, None).astype(np.int16)
+        return previsoes.reshape(24, n_climas)
+
+    def tabela_previsoes(self, data_fixa, uf, municipio):
+        # Tabela (24, n_climas) de _montar_tabela, memoizada por (data, UF, município) num
+        # lru_cache criado por carregar_modelo e descartado junto com o predictor
+        if self._tabela_cache is None:
+            raise RuntimeError("Carregue o modelo com carregar_modelo antes de consultar a tabela.")
+        return self._tabela_cache(data_fixa, uf, municipio)
+
+    def prever_hora(self, data_fixa, hora, uf, municipio, condicao_metereologica):
+        # .item devolve direto um int Python, sem criar o escalar NumPy intermediário
+        return self.tabela_previsoes(data_fixa, uf, municipio).item(hora, self._codigo_clima(condicao_metereologica))
+
+    def previsoes_horas(self, data_fixa, uf, municipio, condicao_metereologica):
+        # Previsões das 24 horas do dia: a coluna do clima na tabela memoizada
+        return self.tabela_previsoes(data_fixa, uf, municipio)[:, self._codigo_clima(condicao_metereologica)]
+
+    def filtrar_opcoes(self, uf_options, municipios_por_uf, condicoes_metereologicas_options):
+        # Mantém só as opções que os encoders conhecem, para que build_feature_vector e a tabela
+        # possam indexar os mapas dos encoders diretamente (UFs sem município válido também saem).
+        # Devolve as opções filtradas e quantas foram removidas de cada tipo
+        enc_maps = self._enc_maps
+        municipios_validos = {
+            uf: tuple(m for m in municipios_por_uf.get(uf, ()) if m in enc_maps["municipio"])
+            for uf in uf_options if uf in enc_maps["uf"]
+        }
+        municipios_validos = {uf: municipios for uf, municipios in municipios_validos.items() if municipios}
+        condicoes_validas = tuple(
+            c for c in condicoes_metereologicas_options
+            if self._simplificar_clima(self._simplificar_clima(c)) in enc_maps["clima"]
+        )
+
+        removidas = {
+            "UFs": len(uf_options) - len(municipios_validos),
+            "municípios": sum(len(municipios_por_uf.get(uf, ())) for uf in uf_options) - sum(len(m) for m in municipios_validos.values()),
+            "condições climáticas": len(condicoes_metereologicas_options) - len(condicoes_validas),
+        }
+        return (tuple(municipios_validos), municipios_validos, condicoes_validas), removidas
+
     def treinar(self, arquivo_json):
         with open(arquivo_json, "r", encoding="utf-8") as f:
             df = pd.DataFrame(json.load(f))
@@ -155,6 +385,7 @@ class AccidentPredictor:
             raise ValueError("Erro: DataFrame vazio após processamento.")
 
         self.feature_names = X.columns.tolist()
+        self._X_treino = X
         grid = {
             "n_estimators": [100, 200],
             "learning_rate": [0.05, 0.1],
@@ -196,10 +427,138 @@ class AccidentPredictor:
             X_prever[c] = 0
         X_prever = X_prever[self.feature_names]
 
-        previsoes = np.clip(np.round(self.modelo.predict(X_prever)), 0, None)
+        previsoes = np.clip(np.round(self._prever_modelo(X_prever)), 0, None)
         df_processado["previsoes_acidentes"] = previsoes
         return df_processado[["data", "previsoes_acidentes"]]
 
+    def compilar_modelo(self, X_amostra=None, libpath="modelo_compilado/predictor.so"):
+        # Gera uma biblioteca nativa do modelo com o tl2cgen. As dicas de desvio (annotate_branch)
+        # vêm da frequência com que cada ramo é tomado numa amostra dos dados (por padrão, o treino)
+        if not self.treinado:
+            raise RuntimeError("Treine o modelo antes de compilar.")
+        if tl2cgen is None:
+            raise ImportError("treelite e tl2cgen são necessários para compilar o modelo.")
+        if X_amostra is None:
+            X_amostra = self._X_treino
+        if X_amostra is None:
+            raise ValueError(
+                "Nenhuma amostra disponível para anotar os desvios: passe X_amostra "
+                "(o modelo carregado de um pickle não guarda a matriz de treino)."
+            )
+
+        libpath = Path(libpath)
+        libpath.parent.mkdir(parents=True, exist_ok=True)
+        anotacao = libpath.parent / "annotation.json"
+
+        modelo_tl = treelite.frontend.from_lightgbm(self.modelo.booster_)
+        dmat = tl2cgen.DMatrix(np.asarray(X_amostra, dtype=np.float64))
+        tl2cgen.annotate_branch(modelo_tl, dmat, path=str(anotacao), verbose=False)
+        tl2cgen.export_lib(
+            modelo_tl,
+            toolchain="gcc",
+            libpath=str(libpath),
+            params={"annotate_in": str(anotacao), "parallel_comp": 8},
+            verbose=False
+        )
+        print(f"Modelo compilado: {libpath}")
+
+    def _criar_sessao_onnx(self):
+        # Converte o LightGBM para ONNX uma única vez, evitando a validação do sklearn/pandas a cada previsão
+        if ort is None:
+            raise ImportError("onnxruntime e onnxmltools são necessários para a sessão ONNX.")
+        modelo_onnx = convert_lightgbm(
+            self.modelo,
+            initial_types=[("X", FloatTensorType([None, len(self.feature_names)]))]
+        )
+        opcoes = ort.SessionOptions()
+        opcoes.intra_op_num_threads = 1
+        opcoes.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return ort.InferenceSession(
+            modelo_onnx.SerializeToString(),
+            sess_options=opcoes,
+            providers=["CPUExecutionProvider"]
+        )
+
+    def _onnx_confere(self, sess, n=2000):
+        # O onnxmltools converte os limiares dos splits para float32, e entradas perto de um limiar
+        # caem no ramo errado. Compara a sessão com o LightGBM numa amostra de datas (um ano para
+        # cada lado de hoje), horas e classes dos encoders; qualquer previsão arredondada diferente
+        # reprova a sessão
+        rng = np.random.default_rng(42)
+        hoje = date.today()
+        datas = [hoje + timedelta(days=int(d)) for d in rng.integers(-365, 366, n)]
+        X = self.build_feature_matrix(
+            datas,
+            rng.integers(0, 24, n),
+            rng.choice(self.encoders["uf"].classes_, n),
+            rng.choice(self.encoders["municipio"].classes_, n),
+            rng.choice(self.encoders["clima"].classes_, n),
+        )
+        esperado = np.clip(np.round(self.modelo.predict(X)), 0, None)
+        obtido = np.clip(np.round(sess.run(None, {"X": X})[0].ravel()), 0, None)
+        return np.array_equal(esperado, obtido)
+
+    @classmethod
+    def carregar_modelo(cls, nome="modelo_acidentes.pkl", libpath="modelo_compilado/predictor.so"):
+        # Mapeia o arquivo em memória e desserializa direto das páginas do SO, sem a cópia
+        # intermediária da leitura sequencial de pickle.load(f)
+        with open(nome, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = pickle.loads(mm)
+
+        predictor = cls()
+        predictor.modelo = data["modelo"]
+        predictor.encoders = data["encoders"]
+        predictor.feature_names = data["features"]
+        predictor.best_params = data["params"]
+        predictor.r2_score = data["r2"]
+        predictor.rmse_score = data["rmse"]
+        predictor.treinado = True
+
+        # Classes dos encoders viram dicts: lookup O(1) em vez de LabelEncoder.transform por previsão.
+        # Valores desconhecidos recebem -1, como em _criar_features. As chaves são internadas, assim
+        # como as opções da interface, para que a comparação no lookup seja por ponteiro
+        predictor._enc_maps = {
+            col: {sys.intern(c) if isinstance(c, str) else c: i for i, c in enumerate(enc.classes_)}
+            for col, enc in predictor.encoders.items()
+        }
+        predictor._enc_default = {col: -1 for col in predictor.encoders}
+        predictor._enc_tipo_padrao = predictor._enc_maps["tipo_acidente"].get(TIPO_ACIDENTE_PADRAO, -1)
+
+        # Posição de cada feature e função de preenchimento gerada para esta ordem de features
+        predictor._feat_index = {nome: i for i, nome in enumerate(predictor.feature_names)}
+        predictor._fill = _gerar_fill(predictor.feature_names)
+        predictor._tabela_cache = functools.lru_cache(maxsize=1024)(predictor._montar_tabela)
+
+        # holidays.Brazil normaliza a chave e expande o ano a cada consulta; um frozenset com os
+        # feriados do período dos dados (2019 em diante) até o ano que vem resolve em O(1)
+        anos_feriados = range(2019, date.today().year + 2)
+        predictor._anos_feriados = anos_feriados
+        predictor._holidays_set = frozenset(holidays.Brazil(years=anos_feriados))
+
+        # Biblioteca gerada por compilar_modelo; só é usada se for mais nova que o pickle,
+        # para não servir um modelo compilado de um treino anterior
+        libpath = Path(libpath)
+        if tl2cgen is not None and libpath.exists() and libpath.stat().st_mtime >= Path(nome).stat().st_mtime:
+            try:
+                predictor._tl = tl2cgen.Predictor(str(libpath))
+            except Exception as e:
+                # Biblioteca incompatível ou corrompida: segue para ONNX ou LightGBM
+                print(f"Não foi possível carregar o modelo compilado {libpath}: {e}")
+
+        # Com a biblioteca compilada carregada, a sessão ONNX nunca seria usada
+        if predictor._tl is None:
+            try:
+                sess = predictor._criar_sessao_onnx()
+                if predictor._onnx_confere(sess):
+                    predictor._ort_sess = sess
+                else:
+                    print("Sessão ONNX descartada: previsões diferentes das do LightGBM (limiares em float32).")
+            except Exception as e:
+                # Sem ONNX, o predictor continua usando o modelo LightGBM original
+                print(f"Não foi possível compilar o modelo para ONNX: {e}")
+
+        return predictor
+
     def salvar_modelo(self, nome="modelo_acidentes.pkl"):
         if not self.treinado:
             raise RuntimeError("Treine o modelo antes de salvar.")
@@ -212,11 +571,17 @@ class AccidentPredictor:
                 "params": self.best_params,
                 "r2": self.r2_score,
                 "rmse": self.rmse_score
-            }, f)
+            }, f, protocol=5)
         print(f"Modelo salvo: {nome}")
 
 
 if __name__ == "__main__":
     predictor = AccidentPredictor()
     predictor.treinar("datatran_consolidado.json")
-    predictor.salvar_modelo()
\ No newline at end of file
+    predictor.salvar_modelo()
+
+    # A compilação é opcional (precisa do tl2cgen e de um compilador C); o pickle já está salvo
+    try:
+        predictor.compilar_modelo()
+    except Exception as e:
+        print(f"Modelo não compilado, a interface usará ONNX ou LightGBM: {e}")
\ No newline at end of file